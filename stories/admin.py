@@ -5,6 +5,7 @@ from .models import Story, GeneratedImage, GenerationSession
 @admin.register(Story)
 class StoryAdmin(admin.ModelAdmin):
     list_display = ('title', 'user', 'created_at', 'updated_at')
+    list_select_related = ('user',)
     list_filter = ('created_at', 'user')
     search_fields = ('title', 'prompt', 'story_text')
     readonly_fields = ('created_at', 'updated_at')
@@ -22,10 +23,19 @@ class StoryAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # The changelist never shows the long generated text
+        changelist = f'{self.opts.app_label}_{self.opts.model_name}_changelist'
+        if request.resolver_match and request.resolver_match.url_name == changelist:
+            queryset = queryset.defer('story_text', 'character_description', 'background_description')
+        return queryset
+
 
 @admin.register(GeneratedImage)
 class GeneratedImageAdmin(admin.ModelAdmin):
     list_display = ('story', 'image_type', 'created_at')
+    list_select_related = ('story',)
     list_filter = ('image_type', 'created_at')
     search_fields = ('story__title', 'prompt_used')
     readonly_fields = ('created_at',)
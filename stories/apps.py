@@ -1,6 +1,12 @@
+import os
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class StoriesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "stories"
+
+    def ready(self):
+        # Generated images are written here on every run
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'generated_images'), exist_ok=True)
@@ -0,0 +1,92 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class ImageBatcher:
+    """Collect image prompts from concurrent generation tasks into batched
+    pipeline calls.
+
+    A single collector thread owns the pipeline. It waits for a prompt, then
+    keeps collecting until the batch is full or the batch window expires, and
+    runs all collected prompts as one forward pass.
+
+    With warmup=True the collector first runs the pipeline once at every batch
+    size up to max_batch_size, so shape-specialized (compiled) kernels are
+    built in the thread that serves requests. ``ready`` is set once done.
+    """
+
+    def __init__(self, pipe, max_batch_size, batch_timeout, num_inference_steps, warmup=False):
+        self.pipe = pipe
+        self.num_inference_steps = num_inference_steps
+        self.max_batch_size = max_batch_size
+        self.batch_timeout = batch_timeout
+        self.warmup = warmup
+        self.ready = threading.Event()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._collect, daemon=True)
+        self.thread.start()
+
+    def submit(self, prompts):
+        """Queue prompts and return one future per prompt resolving to an image"""
+        futures = []
+        for prompt in prompts:
+            future = Future()
+            self.queue.put((prompt, future))
+            futures.append(future)
+        return futures
+
+    @staticmethod
+    def _add_if_live(batch, item):
+        # Callers cancel futures they stopped waiting for; once a future is
+        # marked running it can no longer be cancelled
+        if item[1].set_running_or_notify_cancel():
+            batch.append(item)
+
+    def _next_batch(self):
+        batch = []
+        while not batch:
+            self._add_if_live(batch, self.queue.get())
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            self._add_if_live(batch, item)
+        return batch
+
+    def _warmup(self):
+        for batch_size in range(1, self.max_batch_size + 1):
+            # CUDA graphs are recorded on the second call for a shape
+            self.pipe(["warmup"] * batch_size, num_inference_steps=2, height=512, width=512)
+
+    def _collect(self):
+        try:
+            if self.warmup:
+                self._warmup()
+        except Exception as e:
+            print(f"Error warming up image pipeline: {e}")
+        finally:
+            self.ready.set()
+
+        while True:
+            batch = self._next_batch()
+            try:
+                images = self.pipe(
+                    [prompt for prompt, _ in batch],
+                    num_inference_steps=self.num_inference_steps,
+                    height=512,
+                    width=512
+                ).images
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), image in zip(batch, images):
+                future.set_result(image)
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-14 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stories", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="generatedimage",
+            index=models.Index(
+                fields=["story", "image_type"], name="stories_gen_story_i_03fdfb_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="generatedimage",
+            index=models.Index(
+                fields=["-created_at"], name="stories_gen_created_e1071b_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="generationsession",
+            index=models.Index(
+                fields=["status", "-created_at"], name="stories_gen_status_c33619_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="story",
+            index=models.Index(
+                fields=["-created_at"], name="stories_sto_created_afacec_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="story",
+            index=models.Index(
+                fields=["user", "-created_at"], name="stories_sto_user_id_92c361_idx"
+            ),
+        ),
+    ]
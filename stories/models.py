@@ -20,23 +20,31 @@ class Story(models.Model):
         """Get the first image associated with this story"""
         return self.images.first()
 
+    def _image_of_type(self, image_type):
+        # Iterate images.all() so prefetched images are used without a query
+        return next((image for image in self.images.all() if image.image_type == image_type), None)
+
     @property
     def combined_image(self):
         """Get the combined image for this story"""
-        return self.images.filter(image_type='combined').first()
+        return self._image_of_type('combined')
 
     @property
     def character_image(self):
         """Get the character image for this story"""
-        return self.images.filter(image_type='character').first()
+        return self._image_of_type('character')
 
     @property
     def background_image(self):
         """Get the background image for this story"""
-        return self.images.filter(image_type='background').first()
+        return self._image_of_type('background')
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at']),
+            models.Index(fields=['user', '-created_at']),
+        ]
 
 
 class GeneratedImage(models.Model):
@@ -55,6 +63,10 @@ class GeneratedImage(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['story', 'image_type']),
+            models.Index(fields=['-created_at']),
+        ]
 
 
 class GenerationSession(models.Model):
@@ -74,3 +86,8 @@ class GenerationSession(models.Model):
 
     def __str__(self):
         return f"Session {self.session_id} - {self.status}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-created_at']),
+        ]
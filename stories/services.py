@@ -1,18 +1,20 @@
 import os
+import asyncio
+import threading
+import weakref
+import httpx
+from types import SimpleNamespace
+from functools import lru_cache
+from concurrent.futures import wait
 from langchain_ollama import OllamaLLM
 from langchain.prompts import PromptTemplate
+from ollama import AsyncClient
+from PIL import Image
 from django.conf import settings
+from .image_worker import ImageBatcher
 
 
-class StoryGenerationService:
-    def __init__(self):
-        self.llm = OllamaLLM(
-            base_url=settings.OLLAMA_BASE_URL,
-            model=settings.OLLAMA_MODEL
-        )
-        
-    def create_story_chain(self):
-        story_template = """
+STORY_TEMPLATE = """
         Create an engaging short story based on the following prompt:
         {user_prompt}
         
@@ -21,16 +23,8 @@ class StoryGenerationService:
         
         Story:
         """
-        
-        story_prompt = PromptTemplate(
-            input_variables=["user_prompt"],
-            template=story_template
-        )
-        
-        return story_prompt | self.llm
-    
-    def create_character_description_chain(self):
-        character_template = """
+
+CHARACTER_TEMPLATE = """
         Based on this story, create a detailed visual description of the main character:
         
         Story: {story}
@@ -41,16 +35,8 @@ class StoryGenerationService:
         
         Character Description:
         """
-        
-        character_prompt = PromptTemplate(
-            input_variables=["story"],
-            template=character_template
-        )
-        
-        return character_prompt | self.llm
-    
-    def create_background_description_chain(self):
-        background_template = """
+
+BACKGROUND_TEMPLATE = """
         Based on this story, create a detailed visual description of the main setting/background:
         
         Story: {story}
@@ -61,66 +47,265 @@ class StoryGenerationService:
         
         Background Description:
         """
+
+
+class StoryGenerationService:
+    def __init__(self):
+        self.llm = OllamaLLM(
+            base_url=settings.OLLAMA_BASE_URL,
+            model=settings.OLLAMA_MODEL
+        )
+
+        self._local = threading.local()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+        # Chains never vary between calls, so build them once
+        self.story_chain = self.create_story_chain()
+        self.character_chain = self.create_character_description_chain()
+        self.background_chain = self.create_background_description_chain()
+        
+    def create_story_chain(self):
+        story_prompt = PromptTemplate(
+            input_variables=["user_prompt"],
+            template=STORY_TEMPLATE
+        )
         
+        return story_prompt | self.llm
+    
+    def create_character_description_chain(self):
+        character_prompt = PromptTemplate(
+            input_variables=["story"],
+            template=CHARACTER_TEMPLATE
+        )
+        
+        return character_prompt | self.llm
+    
+    def create_background_description_chain(self):
         background_prompt = PromptTemplate(
             input_variables=["story"],
-            template=background_template
+            template=BACKGROUND_TEMPLATE
         )
         
         return background_prompt | self.llm
     
-    def generate_story(self, user_prompt):
-        """Generate a story based on user prompt"""
-        story_chain = self.create_story_chain()
-        return story_chain.invoke({"user_prompt": user_prompt})
+    def generate_story(self, user_prompt, on_chunk=None):
+        """Generate a story based on user prompt.
+
+        If on_chunk is given, the story is streamed and on_chunk is called
+        with the number of chunks received so far.
+        """
+        if on_chunk is None:
+            return self.story_chain.invoke({"user_prompt": user_prompt})
+
+        chunks = []
+        for chunk in self.story_chain.stream({"user_prompt": user_prompt}):
+            chunks.append(chunk)
+            on_chunk(len(chunks))
+        return "".join(chunks)
     
     def generate_character_description(self, story):
         """Generate character description based on story"""
-        character_chain = self.create_character_description_chain()
-        return character_chain.invoke({"story": story})
+        return self.character_chain.invoke({"story": story})
     
     def generate_background_description(self, story):
         """Generate background description based on story"""
-        background_chain = self.create_background_description_chain()
-        return background_chain.invoke({"story": story})
+        return self.background_chain.invoke({"story": story})
+
+    def _async_client(self):
+        # httpx connections belong to the event loop that opened them, so
+        # keep one keepalive client per loop
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = AsyncClient(
+                host=settings.OLLAMA_BASE_URL,
+                limits=httpx.Limits(max_keepalive_connections=8)
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def _agenerate(self, prompt):
+        response = await self._async_client().generate(model=settings.OLLAMA_MODEL, prompt=prompt)
+        return response["response"]
+
+    async def agenerate_character_description(self, story):
+        """Generate character description based on story (async)"""
+        return await self._agenerate(CHARACTER_TEMPLATE.format(story=story))
+
+    async def agenerate_background_description(self, story):
+        """Generate background description based on story (async)"""
+        return await self._agenerate(BACKGROUND_TEMPLATE.format(story=story))
+
+    def generate_descriptions(self, story):
+        """Generate character and background descriptions concurrently.
+
+        Both requests are in flight at once, so Ollama must be started with
+        OLLAMA_NUM_PARALLEL >= 2 to actually serve them in parallel.
+        """
+        async def gather():
+            return await asyncio.gather(
+                self.agenerate_character_description(story),
+                self.agenerate_background_description(story),
+            )
+
+        # Reuse this thread's loop so its Ollama connections stay open
+        if not hasattr(self._local, "loop"):
+            self._local.loop = asyncio.new_event_loop()
+        return self._local.loop.run_until_complete(gather())
+
+
+@lru_cache(maxsize=1)
+def get_story_service():
+    """Share one StoryGenerationService (and its Ollama client) per process"""
+    return StoryGenerationService()
+
+
+@lru_cache(maxsize=1)
+def _load_ml():
+    """Import the heavy ML libraries once, on first use.
+
+    Only processes that run diffusion pay for torch and diffusers; web and
+    merge workers import this module without loading them. Missing packages
+    leave their entries as None.
+    """
+    ml = SimpleNamespace(
+        torch=None, StableDiffusionPipeline=None, DPMSolverMultistepScheduler=None,
+        AttnProcessor2_0=None, quantize=None, freeze=None, qint8=None
+    )
+    try:
+        import torch
+        from diffusers import StableDiffusionPipeline, DPMSolverMultistepScheduler
+        from diffusers.models.attention_processor import AttnProcessor2_0
+        
+        ml.torch = torch
+        ml.StableDiffusionPipeline = StableDiffusionPipeline
+        ml.DPMSolverMultistepScheduler = DPMSolverMultistepScheduler
+        ml.AttnProcessor2_0 = AttnProcessor2_0
+    except ImportError:
+        pass
+    
+    try:
+        from optimum.quanto import quantize, freeze, qint8
+        
+        ml.quantize, ml.freeze, ml.qint8 = quantize, freeze, qint8
+    except ImportError:
+        pass
+    
+    return ml
+
+
+def quantize_unet(pipe):
+    """Quantize the UNet weights to int8 in place"""
+    ml = _load_ml()
+    if ml.quantize is None:
+        print("Warning: optimum-quanto not available. UNet will not be quantized.")
+        return
+    
+    ml.quantize(pipe.unet, weights=ml.qint8)
+    ml.freeze(pipe.unet)
+
+
+def compile_pipe(pipe):
+    """Compile the UNet and VAE decoder; ImageBatcher warms them up"""
+    torch = _load_ml().torch
+    pipe.unet = torch.compile(pipe.unet, mode="reduce-overhead")
+    pipe.vae.decode = torch.compile(pipe.vae.decode)
+    pipe.is_compiled = True
+
+
+@lru_cache(maxsize=1)
+def get_pipe():
+    """Load the diffusion pipeline once per process and reuse it"""
+    ml = _load_ml()
+    if ml.StableDiffusionPipeline is None:
+        print("Warning: Diffusers not available. Image generation will be disabled.")
+        return None
+    
+    torch = ml.torch
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    pipe = ml.StableDiffusionPipeline.from_pretrained(
+        "runwayml/stable-diffusion-v1-5",
+        torch_dtype=torch.float16 if device == "cuda" else torch.float32
+    ).to(device)
+    # DPM++ reaches PNDM quality in fewer denoising steps
+    pipe.scheduler = ml.DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
+    # Fused memory-efficient attention keeps peak VRAM in check when
+    # several prompts run as one batch; fall back to PyTorch 2 SDPA
+    try:
+        pipe.enable_xformers_memory_efficient_attention()
+    except Exception:
+        pipe.unet.set_attn_processor(ml.AttnProcessor2_0())
+    pipe.enable_vae_slicing()
+    pipe.enable_vae_tiling()
+    if settings.SD_QUANTIZE:
+        quantize_unet(pipe)
+    if settings.SD_COMPILE and settings.SD_QUANTIZE:
+        print("Warning: SD_COMPILE is not supported with SD_QUANTIZE. UNet will not be compiled.")
+    elif settings.SD_COMPILE and device == "cuda":
+        compile_pipe(pipe)
+    return pipe
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    """Start the shared image batcher on first use"""
+    global _batcher
+    # Concurrent tasks must not load the pipeline twice
+    with _batcher_lock:
+        if _batcher is None:
+            pipe = get_pipe()
+            if pipe:
+                _batcher = ImageBatcher(
+                    pipe,
+                    max_batch_size=settings.SD_MAX_BATCH_SIZE,
+                    batch_timeout=settings.SD_BATCH_TIMEOUT,
+                    num_inference_steps=settings.SD_STEPS,
+                    warmup=getattr(pipe, "is_compiled", False)
+                )
+                # Tasks start waiting on results only once warmup is done
+                _batcher.ready.wait()
+    return _batcher
 
 
 class ImageGenerationService:
     def __init__(self):
-        # Initialize diffusion pipeline
-        try:
-            from diffusers import StableDiffusionPipeline
-            import torch
-            
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
-            self.pipe = StableDiffusionPipeline.from_pretrained(
-                "runwayml/stable-diffusion-v1-5",
-                torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
-            ).to(self.device)
-        except ImportError:
-            self.pipe = None
-            print("Warning: Diffusers not available. Image generation will be disabled.")
+        self.batcher = get_batcher()
     
     def generate_image(self, prompt, filename):
         """Generate image from text prompt"""
-        if not self.pipe:
-            return None
+        return self.generate_images([prompt], [filename])[0]
+
+    def generate_images(self, prompts, filenames):
+        """Generate several images from text prompts.
+
+        Prompts go through the shared batcher, so prompts from other sessions
+        in flight at the same time are run in the same forward pass.
+        """
+        if not self.batcher:
+            return [None] * len(prompts)
+            
+        futures = self.batcher.submit(prompts)
+        _, pending = wait(futures, timeout=settings.SD_RESULT_TIMEOUT)
+        if pending:
+            # Drop prompts the batcher has not started so it does not run them
+            # for a session that is about to fail
+            for future in pending:
+                future.cancel()
+            # Fail the session instead of waiting forever on a stalled batcher
+            raise TimeoutError(f"Image generation did not finish within {settings.SD_RESULT_TIMEOUT}s")
             
         try:
-            # Generate image
-            image = self.pipe(
-                prompt,
-                num_inference_steps=20,
-                height=512,
-                width=512
-            ).images[0]
+            images = [future.result() for future in futures]
             
-            # Save image
-            image.save(filename)
-            return filename
+            for image, filename in zip(images, filenames):
+                image.save(filename, format="WEBP", quality=90, method=4)
+            return list(filenames)
         except Exception as e:
-            print(f"Error generating image: {e}")
-            return None
+            print(f"Error generating images: {e}")
+            return [None] * len(prompts)
 
 
 class ImageMergeService:
@@ -128,10 +313,6 @@ class ImageMergeService:
     def merge_images(character_path, background_path, output_path):
         """Merge character and background images"""
         try:
-            from PIL import Image
-            import cv2
-            import numpy as np
-            
             # Load images
             character_img = Image.open(character_path).convert("RGBA")
             background_img = Image.open(background_path).convert("RGB")
@@ -141,21 +322,17 @@ class ImageMergeService:
             character_img = character_img.resize((target_size[0]//2, target_size[1]))
             background_img = background_img.resize(target_size)
             
-            # Convert to numpy arrays
-            char_array = np.array(character_img)
-            bg_array = np.array(background_img)
-            
             # Create combined image
             combined = Image.new("RGB", target_size)
             combined.paste(background_img, (0, 0))
             
             # Paste character on the right side
-            if char_array.shape[2] == 4:  # Has alpha channel
+            if character_img.mode == "RGBA":  # Has alpha channel
                 combined.paste(character_img, (target_size[0]//2, 0), character_img)
             else:
                 combined.paste(character_img, (target_size[0]//2, 0))
             
-            combined.save(output_path)
+            combined.save(output_path, format="WEBP", quality=90, method=4)
             return output_path
             
         except Exception as e:
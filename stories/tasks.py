@@ -0,0 +1,230 @@
+import os
+import uuid
+import shutil
+import hashlib
+from celery import shared_task
+from celery.signals import worker_ready
+from django.conf import settings
+from django.core.cache import cache
+from .models import Story, GeneratedImage, GenerationSession
+from .services import get_story_service, get_batcher, ImageGenerationService, ImageMergeService
+
+
+@worker_ready.connect
+def preload_pipeline(sender, **kwargs):
+    """Import the ML libraries and load the pipeline before a GPU worker takes its first task"""
+    if 'gpu' in sender.app.amqp.queues.consume_from:
+        get_batcher()
+
+
+@shared_task
+def run_generation(session_id, prompt):
+    """Generate story text and images for a session (GPU queue)"""
+    session = GenerationSession.objects.get(session_id=session_id)
+    generate_story_content(session, prompt)
+
+
+@shared_task
+def merge_only(session_id, char_filename, bg_filename):
+    """Merge generated character and background images (CPU queue)"""
+    session = GenerationSession.objects.select_related('story').get(session_id=session_id)
+    merge_story_images(session, char_filename, bg_filename)
+
+
+def prompt_cache_key(user_prompt):
+    """Cache key for the generated content of a normalized prompt"""
+    # Bump the version whenever the cached image format changes
+    return "story:v2:" + hashlib.sha256(user_prompt.strip().lower().encode()).hexdigest()
+
+
+def cached_image_path(filename):
+    return os.path.join(settings.MEDIA_ROOT, 'generated_images', filename)
+
+
+def get_cached_content(cache_key):
+    """Cached content for a prompt, or None on a miss or cache outage"""
+    try:
+        cached = cache.get(cache_key)
+        if cached and not all(
+            os.path.exists(cached_image_path(cached[key]))
+            for key in ('character_image', 'background_image')
+        ):
+            # The cached images were removed; regenerate and refresh the entry
+            cache.delete(cache_key)
+            cached = None
+        return cached
+    except Exception as e:
+        print(f"Error reading story cache: {e}")
+        return None
+
+
+def store_cached_content(cache_key, content):
+    """Cache generated content for a prompt; a cache outage is not an error"""
+    try:
+        cache.set(cache_key, content, timeout=settings.STORY_CACHE_TIMEOUT)
+    except Exception as e:
+        print(f"Error writing story cache: {e}")
+
+
+def copy_cached_image(filename, output_path):
+    """Copy a previously generated image to a new path"""
+    shutil.copyfile(cached_image_path(filename), output_path)
+    return output_path
+
+
+def generate_story_content(session, user_prompt):
+    """Generate story content and images"""
+    try:
+        # Update session status
+        session.status = 'generating_story'
+        session.progress_percentage = 10
+        session.save(update_fields=['status', 'progress_percentage'])
+
+        # Initialize services
+        story_service = get_story_service()
+
+        # Reuse content already generated for the same prompt
+        cache_key = prompt_cache_key(user_prompt)
+        cached = get_cached_content(cache_key)
+
+        # Generate story, advancing progress as tokens stream in
+        def report_progress(chunk_count):
+            progress = min(29, 10 + chunk_count // 20)
+            if progress != session.progress_percentage:
+                session.progress_percentage = progress
+                session.save(update_fields=['progress_percentage'])
+
+        if cached:
+            story_text = cached['story_text']
+        else:
+            story_text = story_service.generate_story(user_prompt, on_chunk=report_progress)
+
+        # Create story object
+        story = Story.objects.create(
+            title=f"Story from: {user_prompt[:50]}...",
+            prompt=user_prompt,
+            story_text=story_text,
+            character_description="",
+            background_description=""
+        )
+
+        session.story = story
+        session.progress_percentage = 30
+        session.save(update_fields=['story', 'progress_percentage'])
+
+        # Generate character and background descriptions concurrently
+        if cached:
+            character_desc = cached['character_description']
+            background_desc = cached['background_description']
+        else:
+            character_desc, background_desc = story_service.generate_descriptions(story_text)
+        story.character_description = character_desc
+        story.background_description = background_desc
+        story.save(update_fields=['character_description', 'background_description', 'updated_at'])
+
+        session.status = 'generating_images'
+        session.progress_percentage = 50
+        session.save(update_fields=['status', 'progress_percentage'])
+
+        # Created at startup by StoriesConfig.ready()
+        media_dir = os.path.join(settings.MEDIA_ROOT, 'generated_images')
+
+        # Generate character and background images in one batch
+        char_filename = f"character_{story.id}_{uuid.uuid4().hex[:8]}.webp"
+        char_path = os.path.join(media_dir, char_filename)
+        bg_filename = f"background_{story.id}_{uuid.uuid4().hex[:8]}.webp"
+        bg_path = os.path.join(media_dir, bg_filename)
+
+        if cached:
+            char_result = copy_cached_image(cached['character_image'], char_path)
+            bg_result = copy_cached_image(cached['background_image'], bg_path)
+        else:
+            image_service = ImageGenerationService()
+            char_result, bg_result = image_service.generate_images(
+                [character_desc, background_desc],
+                [char_path, bg_path]
+            )
+
+            if char_result and bg_result:
+                store_cached_content(cache_key, {
+                    'story_text': story_text,
+                    'character_description': character_desc,
+                    'background_description': background_desc,
+                    'character_image': char_filename,
+                    'background_image': bg_filename,
+                })
+
+        # Record both images in a single INSERT
+        to_create = []
+        if char_result:
+            to_create.append(GeneratedImage(
+                story=story,
+                image_type='character',
+                image_file=f'generated_images/{char_filename}',
+                prompt_used=character_desc
+            ))
+
+        if bg_result:
+            to_create.append(GeneratedImage(
+                story=story,
+                image_type='background',
+                image_file=f'generated_images/{bg_filename}',
+                prompt_used=background_desc
+            ))
+
+        GeneratedImage.objects.bulk_create(to_create)
+
+        # Hand merging off to the CPU queue if both images exist
+        if char_result and bg_result:
+            session.status = 'merging_images'
+            session.progress_percentage = 85
+            session.save(update_fields=['status', 'progress_percentage'])
+
+            merge_only.delay(session.session_id, char_filename, bg_filename)
+            return
+
+        # Complete session
+        session.status = 'completed'
+        session.progress_percentage = 100
+        session.save(update_fields=['status', 'progress_percentage'])
+
+    except Exception as e:
+        session.status = 'failed'
+        session.error_message = str(e)
+        session.save(update_fields=['status', 'error_message'])
+
+
+def merge_story_images(session, char_filename, bg_filename):
+    """Merge a session's character and background images"""
+    try:
+        story = session.story
+        merge_service = ImageMergeService()
+
+        media_dir = os.path.join(settings.MEDIA_ROOT, 'generated_images')
+        char_path = os.path.join(media_dir, char_filename)
+        bg_path = os.path.join(media_dir, bg_filename)
+        # GPU and CPU workers must share MEDIA_ROOT
+        for path in (char_path, bg_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Image to merge not found: {path}")
+
+        combined_filename = f"combined_{story.id}_{uuid.uuid4().hex[:8]}.webp"
+        combined_path = os.path.join(media_dir, combined_filename)
+
+        if merge_service.merge_images(char_path, bg_path, combined_path):
+            GeneratedImage.objects.create(
+                story=story,
+                image_type='combined',
+                image_file=f'generated_images/{combined_filename}',
+                prompt_used=f"Character: {story.character_description}\nBackground: {story.background_description}"
+            )
+
+        # Complete session
+        session.status = 'completed'
+        session.progress_percentage = 100
+        session.save(update_fields=['status', 'progress_percentage'])
+
+    except Exception as e:
+        session.status = 'failed'
+        session.error_message = str(e)
+        session.save(update_fields=['status', 'error_message'])
@@ -1,3 +1,140 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from .image_worker import ImageBatcher
+from .models import GeneratedImage, GenerationSession
+from .tasks import generate_story_content, prompt_cache_key
 
-# Create your tests here.
+
+class FakePipe:
+    """Stands in for the diffusion pipeline, recording each call's prompts"""
+
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    def __call__(self, prompts, **kwargs):
+        self.calls.append(list(prompts))
+        if self.error:
+            raise self.error
+        return SimpleNamespace(images=[f"image:{prompt}" for prompt in prompts])
+
+
+class ImageBatcherTests(SimpleTestCase):
+    def test_concurrent_sessions_share_one_batch(self):
+        pipe = FakePipe()
+        # A long window so the batch only closes once it is full
+        batcher = ImageBatcher(pipe, max_batch_size=8, batch_timeout=5, num_inference_steps=1)
+        results = {}
+
+        def session(index):
+            futures = batcher.submit([f"character {index}", f"background {index}"])
+            results[index] = [future.result(timeout=5) for future in futures]
+
+        threads = [threading.Thread(target=session, args=(index,)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(pipe.calls), 1)
+        self.assertEqual(len(pipe.calls[0]), 8)
+        for index in range(4):
+            self.assertEqual(results[index], [f"image:character {index}", f"image:background {index}"])
+
+    def test_warmup_covers_every_batch_size(self):
+        pipe = FakePipe()
+        batcher = ImageBatcher(pipe, max_batch_size=8, batch_timeout=0.01, num_inference_steps=1, warmup=True)
+
+        self.assertTrue(batcher.ready.wait(5))
+        self.assertEqual([len(prompts) for prompts in pipe.calls], list(range(1, 9)))
+
+    def test_pipeline_error_fails_every_future_in_batch(self):
+        pipe = FakePipe(error=RuntimeError("out of memory"))
+        batcher = ImageBatcher(pipe, max_batch_size=3, batch_timeout=5, num_inference_steps=1)
+
+        futures = batcher.submit(["a", "b", "c"])
+
+        for future in futures:
+            with self.assertRaisesMessage(RuntimeError, "out of memory"):
+                future.result(timeout=5)
+        self.assertEqual(len(pipe.calls), 1)
+
+    def test_cancelled_prompts_are_not_run(self):
+        release = threading.Event()
+        pipe = FakePipe()
+
+        def blocking_pipe(prompts, **kwargs):
+            release.wait(5)
+            return pipe(prompts, **kwargs)
+
+        batcher = ImageBatcher(blocking_pipe, max_batch_size=1, batch_timeout=0.01, num_inference_steps=1)
+        first, = batcher.submit(["first"])
+        cancelled, = batcher.submit(["cancelled"])
+        self.assertTrue(cancelled.cancel())
+        last, = batcher.submit(["last"])
+        release.set()
+
+        self.assertEqual(first.result(timeout=5), "image:first")
+        self.assertEqual(last.result(timeout=5), "image:last")
+        self.assertEqual(pipe.calls, [["first"], ["last"]])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class GenerateStoryContentTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        os.makedirs(os.path.join(self.media_root, 'generated_images'))
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        cache.clear()
+
+    def write_image(self, filename, content):
+        with open(os.path.join(self.media_root, 'generated_images', filename), 'wb') as f:
+            f.write(content)
+
+    def test_cache_hit_copies_images_and_queues_merge(self):
+        prompt = "A brave knight discovers a magical forest"
+        self.write_image('character_cached.webp', b'character')
+        self.write_image('background_cached.webp', b'background')
+        cache.set(prompt_cache_key(prompt), {
+            'story_text': 'Once upon a time...',
+            'character_description': 'A knight in silver armor',
+            'background_description': 'An enchanted forest',
+            'character_image': 'character_cached.webp',
+            'background_image': 'background_cached.webp',
+        })
+        session = GenerationSession.objects.create(session_id='cached-session')
+
+        with mock.patch('stories.tasks.get_story_service') as get_story_service, \
+                mock.patch('stories.tasks.ImageGenerationService') as image_service, \
+                mock.patch('stories.tasks.merge_only') as merge_only:
+            generate_story_content(session, "  a brave knight discovers a MAGICAL forest ")
+
+        get_story_service.return_value.generate_story.assert_not_called()
+        get_story_service.return_value.generate_descriptions.assert_not_called()
+        image_service.assert_not_called()
+
+        session.refresh_from_db()
+        self.assertEqual(session.status, 'merging_images')
+        self.assertEqual(session.progress_percentage, 85)
+        self.assertEqual(session.story.story_text, 'Once upon a time...')
+        self.assertEqual(session.story.character_description, 'A knight in silver armor')
+
+        images = {image.image_type: image for image in GeneratedImage.objects.filter(story=session.story)}
+        self.assertEqual(set(images), {'character', 'background'})
+        char_filename = os.path.basename(images['character'].image_file.name)
+        bg_filename = os.path.basename(images['background'].image_file.name)
+        with open(os.path.join(self.media_root, 'generated_images', char_filename), 'rb') as f:
+            self.assertEqual(f.read(), b'character')
+        with open(os.path.join(self.media_root, 'generated_images', bg_filename), 'rb') as f:
+            self.assertEqual(f.read(), b'background')
+
+        merge_only.delay.assert_called_once_with('cached-session', char_filename, bg_filename)
@@ -9,4 +9,5 @@ urlpatterns = [
     path('story/<int:story_id>/', views.story_detail, name='story_detail'),
     path('generate/', views.generate_story_ajax, name='generate_story'),
     path('status/<str:session_id>/', views.check_generation_status, name='check_status'),
+    path('status/<str:session_id>/stream/', views.stream_generation_status, name='stream_status'),
 ]
\ No newline at end of file
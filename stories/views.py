@@ -1,30 +1,34 @@
-import os
 import uuid
+import asyncio
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
+from django.db.models import Prefetch
 from django.core.files.base import ContentFile
 from django.contrib import messages
 from .models import Story, GeneratedImage, GenerationSession
-from .services import StoryGenerationService, ImageGenerationService, ImageMergeService
+from .tasks import run_generation
 import json
 
 
+def story_cards():
+    """Stories with only the columns needed to render story cards"""
+    return Story.objects.only('id', 'title', 'prompt', 'created_at').prefetch_related(
+        Prefetch('images', queryset=GeneratedImage.objects.only('id', 'story_id', 'image_type', 'image_file', 'created_at'))
+    )
+
+
 def home(request):
     """Home page with story generation form"""
-    recent_stories = Story.objects.all()[:5]
+    recent_stories = story_cards()[:5]
     return render(request, 'stories/home.html', {'recent_stories': recent_stories})
 
 
 def story_detail(request, story_id):
     """Display a specific story with its images"""
-    story = get_object_or_404(Story, id=story_id)
-    images = story.images.all()
-    return render(request, 'stories/story_detail.html', {
-        'story': story,
-        'images': images
-    })
+    story = get_object_or_404(Story.objects.prefetch_related('images'), id=story_id)
+    return render(request, 'stories/story_detail.html', {'story': story})
 
 
 @csrf_exempt
@@ -47,8 +51,15 @@ def generate_story_ajax(request):
             status='pending'
         )
         
-        # Start generation process
-        generate_story_content(session, user_prompt)
+        # Queue generation so the request returns immediately
+        try:
+            run_generation.delay(session_id, user_prompt)
+        except Exception as e:
+            # Nothing will pick the session up, so close it out for status clients
+            session.status = 'failed'
+            session.error_message = f"Could not queue generation: {e}"
+            session.save(update_fields=['status', 'error_message'])
+            raise
         
         return JsonResponse({
             'success': True,
@@ -60,129 +71,68 @@ def generate_story_ajax(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 
-def generate_story_content(session, user_prompt):
-    """Generate story content and images"""
-    try:
-        # Update session status
-        session.status = 'generating_story'
-        session.progress_percentage = 10
-        session.save()
-        
-        # Initialize services
-        story_service = StoryGenerationService()
-        image_service = ImageGenerationService()
-        merge_service = ImageMergeService()
-        
-        # Generate story
-        story_text = story_service.generate_story(user_prompt)
-        
-        # Create story object
-        story = Story.objects.create(
-            title=f"Story from: {user_prompt[:50]}...",
-            prompt=user_prompt,
-            story_text=story_text,
-            character_description="",
-            background_description=""
-        )
-        
-        session.story = story
-        session.progress_percentage = 30
-        session.save()
-        
-        # Generate character description
-        character_desc = story_service.generate_character_description(story_text)
-        story.character_description = character_desc
-        
-        # Generate background description
-        background_desc = story_service.generate_background_description(story_text)
-        story.background_description = background_desc
-        story.save()
-        
-        session.status = 'generating_images'
-        session.progress_percentage = 50
-        session.save()
-        
-        # Create media directories if they don't exist
-        media_dir = os.path.join(settings.MEDIA_ROOT, 'generated_images')
-        os.makedirs(media_dir, exist_ok=True)
-        
-        # Generate character image
-        char_filename = f"character_{story.id}_{uuid.uuid4().hex[:8]}.png"
-        char_path = os.path.join(media_dir, char_filename)
-        
-        if image_service.generate_image(character_desc, char_path):
-            GeneratedImage.objects.create(
-                story=story,
-                image_type='character',
-                image_file=f'generated_images/{char_filename}',
-                prompt_used=character_desc
-            )
-        
-        session.progress_percentage = 70
-        session.save()
-        
-        # Generate background image
-        bg_filename = f"background_{story.id}_{uuid.uuid4().hex[:8]}.png"
-        bg_path = os.path.join(media_dir, bg_filename)
-        
-        if image_service.generate_image(background_desc, bg_path):
-            GeneratedImage.objects.create(
-                story=story,
-                image_type='background',
-                image_file=f'generated_images/{bg_filename}',
-                prompt_used=background_desc
-            )
-        
-        session.status = 'merging_images'
-        session.progress_percentage = 85
-        session.save()
-        
-        # Merge images if both exist
-        if os.path.exists(char_path) and os.path.exists(bg_path):
-            combined_filename = f"combined_{story.id}_{uuid.uuid4().hex[:8]}.png"
-            combined_path = os.path.join(media_dir, combined_filename)
-            
-            if merge_service.merge_images(char_path, bg_path, combined_path):
-                GeneratedImage.objects.create(
-                    story=story,
-                    image_type='combined',
-                    image_file=f'generated_images/{combined_filename}',
-                    prompt_used=f"Character: {character_desc}\nBackground: {background_desc}"
-                )
-        
-        # Complete session
-        session.status = 'completed'
-        session.progress_percentage = 100
-        session.save()
-        
-    except Exception as e:
-        session.status = 'failed'
-        session.error_message = str(e)
-        session.save()
+def session_status(session):
+    """Status payload reported to the client for a generation session"""
+    response_data = {
+        'status': session.status,
+        'progress': session.progress_percentage,
+        'error': session.error_message
+    }
+    
+    if session.status == 'completed' and session.story:
+        response_data['story_id'] = session.story.id
+        response_data['redirect_url'] = f'/story/{session.story.id}/'
+    
+    return response_data
 
 
 def check_generation_status(request, session_id):
     """Check the status of a generation session"""
     try:
-        session = get_object_or_404(GenerationSession, session_id=session_id)
-        
-        response_data = {
-            'status': session.status,
-            'progress': session.progress_percentage,
-            'error': session.error_message
-        }
-        
-        if session.status == 'completed' and session.story:
-            response_data['story_id'] = session.story.id
-            response_data['redirect_url'] = f'/story/{session.story.id}/'
-        
-        return JsonResponse(response_data)
+        session = get_object_or_404(GenerationSession.objects.select_related('story'), session_id=session_id)
+        return JsonResponse(session_status(session))
         
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 
+async def stream_generation_status(request, session_id):
+    """Push generation status changes to the client as Server-Sent Events.
+
+    Served asynchronously under ASGI so open streams do not hold a worker.
+    The stream ends after STATUS_STREAM_MAX_DURATION seconds; EventSource
+    then reconnects on its own.
+    """
+    sessions = GenerationSession.objects.select_related('story')
+    if not await sessions.filter(session_id=session_id).aexists():
+        raise Http404("Generation session not found")
+    
+    async def events():
+        loop = asyncio.get_running_loop()
+        started = last_sent = loop.time()
+        last_data = None
+        while loop.time() - started < settings.STATUS_STREAM_MAX_DURATION:
+            session = await sessions.aget(session_id=session_id)
+            data = session_status(session)
+            if data != last_data:
+                yield f"data: {json.dumps(data)}\n\n"
+                last_data = data
+                last_sent = loop.time()
+            elif loop.time() - last_sent >= settings.STATUS_STREAM_KEEPALIVE:
+                # Comment lines keep proxies open and surface disconnects
+                yield ": keepalive\n\n"
+                last_sent = loop.time()
+            if session.status in ('completed', 'failed'):
+                return
+            await asyncio.sleep(1)
+    
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def story_list(request):
     """List all generated stories"""
-    stories = Story.objects.all()
+    stories = story_cards()
     return render(request, 'stories/story_list.html', {'stories': stories})
@@ -31,6 +31,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    "daphne",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -69,6 +70,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "story_generator.wsgi.application"
+ASGI_APPLICATION = "story_generator.asgi.application"
 
 
 # Database
@@ -139,3 +141,38 @@ OLLAMA_MODEL = "llama2"  # Change to your preferred model
 # Image Generation Settings
 MAX_IMAGE_SIZE = (1024, 1024)
 IMAGE_MERGE_SIZE = (1024, 512)
+SD_STEPS = 15  # Denoising steps for the DPM++ scheduler
+SD_QUANTIZE = False  # Quantize UNet weights to int8 (requires optimum-quanto)
+SD_COMPILE = False  # torch.compile the UNet and VAE decoder on CUDA (requires PyTorch >= 2.1); slows worker startup
+SD_MAX_BATCH_SIZE = 8  # Most prompts run in one pipeline call
+SD_BATCH_TIMEOUT = 0.01  # Seconds to wait for more prompts before running a batch
+SD_RESULT_TIMEOUT = 300  # Seconds a task waits for its images before failing
+
+# Cache Configuration
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": "redis://localhost:6379/2",
+    }
+}
+
+# Seconds to reuse generated content for a repeated prompt
+STORY_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Generation status stream (Server-Sent Events)
+STATUS_STREAM_MAX_DURATION = 120  # Seconds before the stream closes and the client reconnects
+STATUS_STREAM_KEEPALIVE = 15  # Seconds between keepalive comments when nothing changes
+
+# Celery Configuration
+CELERY_BROKER_URL = "redis://localhost:6379/0"
+CELERY_RESULT_BACKEND = "redis://localhost:6379/1"
+CELERY_TASK_SERIALIZER = "json"
+CELERY_RESULT_SERIALIZER = "json"
+CELERY_ACCEPT_CONTENT = ["json"]
+CELERY_TIMEZONE = TIME_ZONE
+
+# Diffusion runs on GPU workers, PIL merging on CPU workers
+CELERY_TASK_ROUTES = {
+    "stories.tasks.run_generation": {"queue": "gpu"},
+    "stories.tasks.merge_only": {"queue": "cpu"},
+}